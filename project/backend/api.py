@@ -10,6 +10,7 @@ MEMORY-OPTIMIZED FastAPI server for Render 512MB limit:
 import sys
 import os
 import gc
+import asyncio
 import torch
 
 # Add project root to PYTHONPATH
@@ -17,18 +18,30 @@ ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import traceback
 import json
+import secrets
 from typing import Optional
 from datetime import datetime
 
 # Import prediction functions
 from backend.image_predict import load_image_model_cpu, predict_image_bytes_memory_safe
 from backend.tabular_predict import load_tabular_model, predict_tabular_memory_safe
+from backend.stream_predict import (
+    CineLoopSession, StreamFrameError, DEFAULT_BATCH_SIZE, DEFAULT_HASH_THRESHOLD
+)
+from backend.memory_profile import (
+    PROFILE_HEADER, PROFILE_ID_HEADER, start_profile, get_memory_report, clear_memory_report,
+    request_started, request_finished
+)
+
+# Token guarding the memory profile admin endpoint (endpoint disabled if unset)
+MEMORY_PROFILE_ADMIN_TOKEN = os.environ.get("MEMORY_PROFILE_ADMIN_TOKEN")
 
 app = FastAPI(
     title="Memory-Optimized Breast Cancer Detection API",
@@ -36,22 +49,42 @@ app = FastAPI(
     version="3.0.0"
 )
 
+ALLOWED_ORIGINS = [
+    "https://early-breast-cancer-detection.vercel.app",
+    "https://breast-cancer-detection-using-ml.vercel.app",
+    "http://localhost:3000",
+    "http://localhost:8000"
+]
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "https://early-breast-cancer-detection.vercel.app",
-        "https://breast-cancer-detection-using-ml.vercel.app",
-        "http://localhost:3000",
-        "http://localhost:8000"
-    ],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[PROFILE_ID_HEADER],
 )
 
+@app.middleware("http")
+async def track_in_flight_requests(request: Request, call_next):
+    """Count in-flight requests so overlapping memory profiles can be flagged"""
+    request_started()
+    try:
+        return await call_next(request)
+    finally:
+        request_finished()
+
 # NO GLOBAL MODEL STORAGE - Models loaded on-demand only
 
+# One model load/forward pass at a time across HTTP endpoints and streams
+MODEL_LOCK = asyncio.Lock()
+
+# Each open stream holds a model for its lifetime - cap concurrent streams
+MAX_CONCURRENT_STREAMS = int(os.environ.get("MAX_CONCURRENT_STREAMS", 1))
+STREAM_IDLE_TIMEOUT = float(os.environ.get("STREAM_IDLE_TIMEOUT", 60))
+_active_streams = 0
+
 # Real model metrics
 IMAGE_MODEL_METRICS = {
     "accuracy": 94.2,
@@ -104,10 +137,17 @@ def cleanup_memory():
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
 
+def profiled_json_response(response, profiler):
+    """Serialize response inside the profiler's json_serialization stage"""
+    headers = {PROFILE_ID_HEADER: profiler.profile_id} if profiler.enabled else None
+    with profiler.stage("json_serialization"):
+        return JSONResponse(response, headers=headers)
+
 @app.post("/predict/image")
 async def predict_image(
     file: UploadFile = File(...),
-    return_gradcam: bool = Form(False)
+    return_gradcam: bool = Form(False),
+    x_memory_profile: Optional[str] = Header(None)
 ):
     """
     MEMORY-SAFE image prediction:
@@ -118,64 +158,71 @@ async def predict_image(
     5. Cleanup all memory
     """
     model = None
-    try:
-        print("🔄 Loading image model on-demand...")
-        
-        # Read image bytes first
-        content = await file.read()
-        
-        # STEP 1: Load model, predict, unload immediately
-        model = load_image_model_cpu()
-        pred_class, prob = predict_image_bytes_memory_safe(model, content, gradcam=False)
-        
-        # STEP 2: Unload model immediately after prediction
-        del model
-        cleanup_memory()
-        print("🗑️  Image model unloaded")
-        
-        # Convert to standard format
-        prediction = "benign" if pred_class == 0 else "malignant"
-        confidence = float(prob * 100)
-        
-        gradcam_b64 = None
-        
-        # STEP 3: Load Grad-CAM only if requested (separate memory cycle)
-        if return_gradcam:
-            print("🔄 Loading Grad-CAM on-demand...")
-            model = load_image_model_cpu()
-            _, _, gradcam_b64 = predict_image_bytes_memory_safe(model, content, gradcam=True)
+    profiler = start_profile("/predict/image", x_memory_profile)
+    # Serialize model work with streams and other requests
+    async with MODEL_LOCK:
+        try:
+            print("🔄 Loading image model on-demand...")
+            
+            # Read image bytes first
+            with profiler.stage("upload_buffering"):
+                content = await file.read()
             
-            # Unload Grad-CAM resources immediately
+            # STEP 1: Load model, predict, unload immediately
+            with profiler.stage("model_load"):
+                model = load_image_model_cpu()
+            pred_class, prob = predict_image_bytes_memory_safe(model, content, gradcam=False, profiler=profiler)
+            
+            # STEP 2: Unload model immediately after prediction
             del model
             cleanup_memory()
-            print("🗑️  Grad-CAM resources unloaded")
-        
-        response = {
-            "prediction": prediction,
-            "confidence": round(confidence, 2),
-            "predicted_class": int(pred_class),
-            "probability": float(prob),
-            "gradcam": gradcam_b64,
-            "gradcam_enabled": return_gradcam,
-            "memory_optimized": True,
-            "metrics": IMAGE_MODEL_METRICS,
-            "timestamp": datetime.utcnow().isoformat(),
-            "type": "image"
-        }
-        
-        return JSONResponse(response)
+            print("🗑️  Image model unloaded")
+            
+            # Convert to standard format
+            prediction = "benign" if pred_class == 0 else "malignant"
+            confidence = float(prob * 100)
+            
+            gradcam_b64 = None
+            
+            # STEP 3: Load Grad-CAM only if requested (separate memory cycle)
+            if return_gradcam:
+                print("🔄 Loading Grad-CAM on-demand...")
+                with profiler.stage("model_load"):
+                    model = load_image_model_cpu()
+                _, _, gradcam_b64 = predict_image_bytes_memory_safe(model, content, gradcam=True, profiler=profiler)
+                
+                # Unload Grad-CAM resources immediately
+                del model
+                cleanup_memory()
+                print("🗑️  Grad-CAM resources unloaded")
+            
+            response = {
+                "prediction": prediction,
+                "confidence": round(confidence, 2),
+                "predicted_class": int(pred_class),
+                "probability": float(prob),
+                "gradcam": gradcam_b64,
+                "gradcam_enabled": return_gradcam,
+                "memory_optimized": True,
+                "metrics": IMAGE_MODEL_METRICS,
+                "timestamp": datetime.utcnow().isoformat(),
+                "type": "image"
+            }
+            
+            return profiled_json_response(response, profiler)
+            
+        except Exception as exc:
+            # Cleanup on error
+            if model is not None:
+                del model
+            cleanup_memory()
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(exc))
         
-    except Exception as exc:
-        # Cleanup on error
-        if model is not None:
-            del model
-        cleanup_memory()
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(exc))
-    
-    finally:
-        # Final cleanup
-        cleanup_memory()
+        finally:
+            # Final cleanup
+            cleanup_memory()
+            profiler.finish()
 
 class TabularInput(BaseModel):
     """Input schema for tabular prediction"""
@@ -191,7 +238,10 @@ class TabularInput(BaseModel):
     fractal_dimension_mean: float
 
 @app.post("/predict/tabular")
-async def predict_tabular_endpoint(payload: TabularInput):
+async def predict_tabular_endpoint(
+    payload: TabularInput,
+    x_memory_profile: Optional[str] = Header(None)
+):
     """
     MEMORY-SAFE tabular prediction:
     1. Load model on-demand
@@ -201,157 +251,367 @@ async def predict_tabular_endpoint(payload: TabularInput):
     """
     tab_model = None
     scaler = None
+    profiler = start_profile("/predict/tabular", x_memory_profile)
     
-    try:
-        print("🔄 Loading tabular model on-demand...")
-        
-        # Load model on-demand
-        tab_model, scaler, selected_cols = load_tabular_model()
-        
-        # Convert input to dict
-        input_data = {
-            "mean radius": payload.radius_mean,
-            "mean texture": payload.texture_mean,
-            "mean perimeter": payload.perimeter_mean,
-            "mean area": payload.area_mean,
-            "mean smoothness": payload.smoothness_mean,
-            "mean compactness": payload.compactness_mean,
-            "mean concavity": payload.concavity_mean,
-            "mean concave points": payload.concave_points_mean,
-            "mean symmetry": payload.symmetry_mean,
-            "mean fractal dimension": payload.fractal_dimension_mean
-        }
-        
-        # Predict with memory-safe function (no SHAP for memory)
-        pred_class, confidence, proba = predict_tabular_memory_safe(
-            tab_model, scaler, input_data, selected_cols
-        )
-        
-        # Unload models immediately
-        del tab_model, scaler
-        cleanup_memory()
-        print("🗑️  Tabular model unloaded")
-        
-        # Convert to standard format
-        prediction = "benign" if pred_class == 1 else "malignant"
-        
-        response = {
-            "prediction": prediction,
-            "confidence": round(float(confidence), 2),
-            "probabilities": {
-                "malignant": round(float(proba[0]) * 100, 2),
-                "benign": round(float(proba[1]) * 100, 2),
-            },
-            "predicted_class": int(pred_class),
-            "shap": None,  # Disabled for memory optimization
-            "memory_optimized": True,
-            "metrics": TABULAR_MODEL_METRICS,
-            "timestamp": datetime.utcnow().isoformat(),
-            "type": "tabular"
-        }
-        
-        return JSONResponse(response)
+    # Serialize model work with streams and other requests
+    async with MODEL_LOCK:
+        try:
+            print("🔄 Loading tabular model on-demand...")
+            
+            # Load model on-demand
+            with profiler.stage("model_load"):
+                tab_model, scaler, selected_cols = load_tabular_model()
+            
+            # Convert input to dict
+            input_data = {
+                "mean radius": payload.radius_mean,
+                "mean texture": payload.texture_mean,
+                "mean perimeter": payload.perimeter_mean,
+                "mean area": payload.area_mean,
+                "mean smoothness": payload.smoothness_mean,
+                "mean compactness": payload.compactness_mean,
+                "mean concavity": payload.concavity_mean,
+                "mean concave points": payload.concave_points_mean,
+                "mean symmetry": payload.symmetry_mean,
+                "mean fractal dimension": payload.fractal_dimension_mean
+            }
+            
+            # Predict with memory-safe function (no SHAP for memory)
+            with profiler.stage("tabular_predict"):
+                pred_class, confidence, proba = predict_tabular_memory_safe(
+                    tab_model, scaler, input_data, selected_cols
+                )
+            
+            # Unload models immediately
+            del tab_model, scaler
+            cleanup_memory()
+            print("🗑️  Tabular model unloaded")
+            
+            # Convert to standard format
+            prediction = "benign" if pred_class == 1 else "malignant"
+            
+            response = {
+                "prediction": prediction,
+                "confidence": round(float(confidence), 2),
+                "probabilities": {
+                    "malignant": round(float(proba[0]) * 100, 2),
+                    "benign": round(float(proba[1]) * 100, 2),
+                },
+                "predicted_class": int(pred_class),
+                "shap": None,  # Disabled for memory optimization
+                "memory_optimized": True,
+                "metrics": TABULAR_MODEL_METRICS,
+                "timestamp": datetime.utcnow().isoformat(),
+                "type": "tabular"
+            }
+            
+            return profiled_json_response(response, profiler)
+            
+        except Exception as exc:
+            # Cleanup on error
+            if tab_model is not None:
+                del tab_model
+            if scaler is not None:
+                del scaler
+            cleanup_memory()
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(exc))
         
-    except Exception as exc:
-        # Cleanup on error
-        if tab_model is not None:
-            del tab_model
-        if scaler is not None:
-            del scaler
-        cleanup_memory()
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(exc))
-    
-    finally:
-        # Final cleanup
-        cleanup_memory()
+        finally:
+            # Final cleanup
+            cleanup_memory()
+            profiler.finish()
 
 @app.post("/predict/multimodal")
 async def predict_multimodal_endpoint(
     file: UploadFile = File(...),
-    features: str = Form(...)
+    features: str = Form(...),
+    x_memory_profile: Optional[str] = Header(None)
 ):
     """
     MEMORY-SAFE multimodal prediction:
     Sequential model loading to avoid memory spikes
     """
-    try:
-        print("🔄 Starting multimodal prediction (sequential)...")
-        
-        # Read image
-        content = await file.read()
-        
-        # Parse features
+    profiler = start_profile("/predict/multimodal", x_memory_profile)
+    # Serialize model work with streams and other requests
+    async with MODEL_LOCK:
         try:
-            parsed_features = json.loads(features)
-        except Exception:
-            parts = features.split(',')
-            parsed_features = [float(x.strip()) for x in parts]
-        
-        # STEP 1: Image prediction (load -> predict -> unload)
-        print("🔄 Image prediction...")
-        model = load_image_model_cpu()
-        img_pred_class, img_prob = predict_image_bytes_memory_safe(model, content, gradcam=False)
-        del model
-        cleanup_memory()
-        print("🗑️  Image model unloaded")
-        
-        # STEP 2: Tabular prediction (load -> predict -> unload)
-        print("🔄 Tabular prediction...")
-        tab_model, scaler, selected_cols = load_tabular_model()
+            print("🔄 Starting multimodal prediction (sequential)...")
+            
+            # Read image
+            with profiler.stage("upload_buffering"):
+                content = await file.read()
+            
+            # Parse features
+            try:
+                parsed_features = json.loads(features)
+            except Exception:
+                parts = features.split(',')
+                parsed_features = [float(x.strip()) for x in parts]
+            
+            # STEP 1: Image prediction (load -> predict -> unload)
+            print("🔄 Image prediction...")
+            with profiler.stage("model_load"):
+                model = load_image_model_cpu()
+            img_pred_class, img_prob = predict_image_bytes_memory_safe(model, content, gradcam=False, profiler=profiler)
+            del model
+            cleanup_memory()
+            print("🗑️  Image model unloaded")
+            
+            # STEP 2: Tabular prediction (load -> predict -> unload)
+            print("🔄 Tabular prediction...")
+            with profiler.stage("model_load"):
+                tab_model, scaler, selected_cols = load_tabular_model()
+            
+            # Convert features to dict format
+            feature_names = [
+                "mean radius", "mean texture", "mean perimeter", "mean area", "mean smoothness",
+                "mean compactness", "mean concavity", "mean concave points", "mean symmetry", "mean fractal dimension"
+            ]
+            input_data = {name: float(val) for name, val in zip(feature_names, parsed_features[:10])}
+            
+            with profiler.stage("tabular_predict"):
+                tab_pred_class, tab_confidence, tab_proba = predict_tabular_memory_safe(
+                    tab_model, scaler, input_data, selected_cols
+                )
+            del tab_model, scaler
+            cleanup_memory()
+            print("🗑️  Tabular model unloaded")
+            
+            # STEP 3: Combine predictions
+            final_prob = (img_prob + tab_confidence/100) / 2.0
+            prediction = "malignant" if final_prob > 0.5 else "benign"
+            confidence = float(final_prob * 100)
+            
+            # Combined metrics
+            combined_metrics = {
+                "accuracy": round((IMAGE_MODEL_METRICS["accuracy"] + TABULAR_MODEL_METRICS["accuracy"]) / 2, 1),
+                "precision": round((IMAGE_MODEL_METRICS["precision"] + TABULAR_MODEL_METRICS["precision"]) / 2, 1),
+                "recall": round((IMAGE_MODEL_METRICS["recall"] + TABULAR_MODEL_METRICS["recall"]) / 2, 1),
+                "f1Score": round((IMAGE_MODEL_METRICS["f1Score"] + TABULAR_MODEL_METRICS["f1Score"]) / 2, 1),
+                "version": "3.0.0",
+                "algorithm": "Sequential Multimodal (Memory-Optimized)"
+            }
+            
+            response = {
+                "prediction": prediction,
+                "confidence": round(confidence, 2),
+                "image_confidence": round(float(img_prob) * 100, 2),
+                "tabular_confidence": round(float(tab_confidence), 2),
+                "gradcam": None,  # Disabled for memory
+                "shap": None,     # Disabled for memory
+                "memory_optimized": True,
+                "sequential_processing": True,
+                "metrics": combined_metrics,
+                "timestamp": datetime.utcnow().isoformat(),
+                "type": "multimodal"
+            }
+            
+            return profiled_json_response(response, profiler)
+            
+        except Exception as exc:
+            cleanup_memory()
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(exc))
         
-        # Convert features to dict format
-        feature_names = [
-            "mean radius", "mean texture", "mean perimeter", "mean area", "mean smoothness",
-            "mean compactness", "mean concavity", "mean concave points", "mean symmetry", "mean fractal dimension"
-        ]
-        input_data = {name: float(val) for name, val in zip(feature_names, parsed_features[:10])}
+        finally:
+            cleanup_memory()
+            profiler.finish()
+
+@app.get("/admin/memory-profile")
+async def memory_profile_report(
+    reset: bool = False,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Rolling per-request memory attribution report.
+    Enable profiling with the X-Memory-Profile: 1 header or MEMORY_PROFILE=1.
+    Requires MEMORY_PROFILE_ADMIN_TOKEN to be set and sent as X-Admin-Token.
+    Pass reset=true to clear stored profiles after reading.
+    """
+    if not MEMORY_PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(
+        (x_admin_token or "").encode(), MEMORY_PROFILE_ADMIN_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    
+    report = get_memory_report()
+    if reset:
+        clear_memory_report()
+    
+    return JSONResponse(report)
+
+@app.websocket("/predict/stream")
+async def predict_stream_endpoint(websocket: WebSocket):
+    """
+    MEMORY-SAFE cine-loop streaming prediction:
+    1. Reject origins outside ALLOWED_ORIGINS (CORS does not cover WebSockets)
+    2. Reject if MAX_CONCURRENT_STREAMS streams are already open
+    3. Load model once for the connection
+    4. Each binary message is one encoded frame, decoded on arrival
+    5. Near-duplicate frames skipped via perceptual hash
+    6. Remaining frames scored in small batches (off the event loop,
+       serialized with HTTP inference via MODEL_LOCK)
+    7. Per-frame scores + running aggregate streamed back
+    8. Unload model when the stream ends or goes idle
+
+    Text messages: {"action": "flush"} scores pending frames now,
+    {"action": "end"} flushes, sends the final aggregate and closes.
+    Query params: batch_size, hash_threshold
+    Idle timeout: STREAM_IDLE_TIMEOUT seconds without a message
+    Memory profiling: X-Memory-Profile header or MEMORY_PROFILE=1
+    """
+    global _active_streams
+    
+    # Browsers always send Origin; non-browser clients may omit it
+    origin = websocket.headers.get("origin")
+    if origin is not None and origin not in ALLOWED_ORIGINS:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    
+    # Each stream holds its own model - cap them to stay under 512MB
+    if _active_streams >= MAX_CONCURRENT_STREAMS:
+        await websocket.send_json({"type": "error", "detail": "Too many active streams, try again later"})
+        await websocket.close(code=1013)
+        return
+    _active_streams += 1
+    request_started()
+    
+    model = None
+    session = None
+    profiler = start_profile("/predict/stream", websocket.headers.get(PROFILE_HEADER))
+    
+    try:
+        try:
+            batch_size = int(websocket.query_params.get("batch_size", DEFAULT_BATCH_SIZE))
+            hash_threshold = int(websocket.query_params.get("hash_threshold", DEFAULT_HASH_THRESHOLD))
+        except ValueError:
+            await websocket.send_json({"type": "error", "detail": "batch_size and hash_threshold must be integers"})
+            await websocket.close(code=1003)
+            return
         
-        tab_pred_class, tab_confidence, tab_proba = predict_tabular_memory_safe(
-            tab_model, scaler, input_data, selected_cols
+        print("🔄 Loading image model for stream...")
+        async with MODEL_LOCK:
+            with profiler.stage("model_load"):
+                model = await run_in_threadpool(load_image_model_cpu)
+        session = CineLoopSession(
+            model, batch_size=batch_size, hash_threshold=hash_threshold, profiler=profiler
         )
-        del tab_model, scaler
-        cleanup_memory()
-        print("🗑️  Tabular model unloaded")
-        
-        # STEP 3: Combine predictions
-        final_prob = (img_prob + tab_confidence/100) / 2.0
-        prediction = "malignant" if final_prob > 0.5 else "benign"
-        confidence = float(final_prob * 100)
         
-        # Combined metrics
-        combined_metrics = {
-            "accuracy": round((IMAGE_MODEL_METRICS["accuracy"] + TABULAR_MODEL_METRICS["accuracy"]) / 2, 1),
-            "precision": round((IMAGE_MODEL_METRICS["precision"] + TABULAR_MODEL_METRICS["precision"]) / 2, 1),
-            "recall": round((IMAGE_MODEL_METRICS["recall"] + TABULAR_MODEL_METRICS["recall"]) / 2, 1),
-            "f1Score": round((IMAGE_MODEL_METRICS["f1Score"] + TABULAR_MODEL_METRICS["f1Score"]) / 2, 1),
-            "version": "3.0.0",
-            "algorithm": "Sequential Multimodal (Memory-Optimized)"
-        }
+        await profiled_send_json(websocket, {
+            "type": "ready",
+            "batch_size": session.batch_size,
+            "hash_threshold": session.hash_threshold,
+            "max_pending_frames": session.max_pending_frames
+        }, profiler)
         
-        response = {
-            "prediction": prediction,
-            "confidence": round(confidence, 2),
-            "image_confidence": round(float(img_prob) * 100, 2),
-            "tabular_confidence": round(float(tab_confidence), 2),
-            "gradcam": None,  # Disabled for memory
-            "shap": None,     # Disabled for memory
-            "memory_optimized": True,
-            "sequential_processing": True,
-            "metrics": combined_metrics,
-            "timestamp": datetime.utcnow().isoformat(),
-            "type": "multimodal"
-        }
-        
-        return JSONResponse(response)
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), timeout=STREAM_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Free the stream slot and model held by a stalled client
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": f"Stream idle for {STREAM_IDLE_TIMEOUT:g}s, closing",
+                    "aggregate": session.aggregate()
+                })
+                await websocket.close(code=1008)
+                break
+            
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            frame_bytes = message.get("bytes")
+            if frame_bytes is not None:
+                # Decode + (possibly) batched inference in a worker thread
+                try:
+                    async with MODEL_LOCK:
+                        results = await run_in_threadpool(session.add_frame, frame_bytes)
+                except StreamFrameError as exc:
+                    await send_stream_frame_error(websocket, session, exc)
+                    continue
+                
+                if results:
+                    await profiled_send_json(websocket, {
+                        "type": "frames",
+                        "results": results,
+                        "aggregate": session.aggregate()
+                    }, profiler)
+                continue
+            
+            try:
+                action = json.loads(message.get("text") or "{}").get("action")
+            except Exception:
+                action = None
+            
+            if action not in ("flush", "end"):
+                await websocket.send_json({"type": "error", "detail": "Unknown action, expected 'flush' or 'end'"})
+                continue
+            
+            try:
+                async with MODEL_LOCK:
+                    results = await run_in_threadpool(session.flush)
+            except StreamFrameError as exc:
+                await send_stream_frame_error(websocket, session, exc)
+                results = []
+            
+            if action == "flush":
+                await profiled_send_json(websocket, {
+                    "type": "frames",
+                    "results": results,
+                    "aggregate": session.aggregate()
+                }, profiler)
+            else:
+                await profiled_send_json(websocket, {
+                    "type": "complete",
+                    "results": results,
+                    "aggregate": session.aggregate(),
+                    "memory_optimized": True,
+                    "metrics": IMAGE_MODEL_METRICS,
+                    "timestamp": datetime.utcnow().isoformat()
+                }, profiler)
+                await websocket.close()
+                break
         
+    except WebSocketDisconnect:
+        pass
+    
     except Exception as exc:
-        cleanup_memory()
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(exc))
+        try:
+            await websocket.send_json({"type": "error", "detail": str(exc)})
+            await websocket.close(code=1011)
+        except Exception:
+            pass
     
     finally:
+        # Unload model and drop any pending frames
+        _active_streams -= 1
+        del session
+        if model is not None:
+            del model
         cleanup_memory()
+        profiler.finish()
+        request_finished()
+        print("🗑️  Stream image model unloaded")
+
+async def profiled_send_json(websocket, payload, profiler):
+    """Serialize and send a stream message inside the json_serialization stage"""
+    with profiler.stage("json_serialization"):
+        await websocket.send_json(payload)
+
+async def send_stream_frame_error(websocket, session, exc):
+    """Report every frame lost to a failed decode or batch"""
+    traceback.print_exc()
+    await websocket.send_json({
+        "type": "error",
+        "frame_indices": exc.frame_indices,
+        "detail": str(exc),
+        "aggregate": session.aggregate()
+    })
 
 if __name__ == "__main__":
     import uvicorn
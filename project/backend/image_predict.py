@@ -26,6 +26,8 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
+from backend.memory_profile import NULL_PROFILER
+
 MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
 
 def load_image_model_cpu():
@@ -60,6 +62,10 @@ def image_bytes_to_tensor_cpu(image_bytes, image_size=224):
     # Open and convert image
     image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
     
+    return pil_image_to_tensor_cpu(image, image_size=image_size)
+
+def pil_image_to_tensor_cpu(image, image_size=224):
+    """Convert an already decoded RGB PIL image to a CPU tensor"""
     # Minimal transforms for memory efficiency
     transform = transforms.Compose([
         transforms.Resize((image_size, image_size)),
@@ -73,7 +79,7 @@ def image_bytes_to_tensor_cpu(image_bytes, image_size=224):
     
     return tensor
 
-def predict_image_bytes_memory_safe(model, image_bytes, gradcam=False):
+def predict_image_bytes_memory_safe(model, image_bytes, gradcam=False, profiler=None):
     """
     Memory-safe prediction with optional Grad-CAM
     
@@ -81,19 +87,26 @@ def predict_image_bytes_memory_safe(model, image_bytes, gradcam=False):
         model: Loaded EfficientNet model
         image_bytes: Raw image bytes
         gradcam: Whether to generate Grad-CAM (memory intensive)
+        profiler: Optional MemoryProfiler for per-stage attribution
     
     Returns:
         If gradcam=False: (pred_class, probability)
         If gradcam=True: (pred_class, probability, gradcam_b64)
     """
     device = torch.device("cpu")
+    profiler = profiler or NULL_PROFILER
     
-    # Convert to tensor
-    tensor = image_bytes_to_tensor_cpu(image_bytes, image_size=224)
-    tensor = tensor.to(device)
+    # Decode and convert to tensor
+    with profiler.stage("pil_decode"):
+        image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    with profiler.stage("tensor", track_torch=True):
+        tensor = pil_image_to_tensor_cpu(image, image_size=224)
+        tensor = tensor.to(device)
+        image.close()
+        del image
     
     # Prediction with no gradients for memory efficiency
-    with torch.no_grad():
+    with profiler.stage("forward", track_torch=True), torch.no_grad():
         output = model(tensor)
         probs = torch.softmax(output, dim=1)
         pred_class = int(output.argmax(dim=1).item())
@@ -108,15 +121,50 @@ def predict_image_bytes_memory_safe(model, image_bytes, gradcam=False):
     
     # Grad-CAM generation (separate memory cycle)
     print("🔄 Generating Grad-CAM...")
-    gradcam_b64 = generate_gradcam_memory_safe(model, image_bytes, pred_class)
+    gradcam_b64 = generate_gradcam_memory_safe(model, image_bytes, pred_class, profiler=profiler)
     
     return pred_class, prob, gradcam_b64
 
-def generate_gradcam_memory_safe(model, image_bytes, class_idx):
+def predict_tensor_batch_memory_safe(model, tensors):
+    """
+    Memory-safe batched prediction for pre-decoded frames
+    
+    Args:
+        model: Loaded EfficientNet model
+        tensors: List of [1, 3, H, W] CPU tensors
+    
+    Returns:
+        List of (pred_class, probability, malignant_probability) tuples
+    """
+    if not tensors:
+        return []
+    
+    batch = torch.cat(tensors, dim=0)
+    
+    # Single forward pass for the whole batch, no gradients
+    with torch.no_grad():
+        output = model(batch)
+        probs = torch.softmax(output, dim=1)
+        pred_classes = output.argmax(dim=1).tolist()
+        probs_list = probs.tolist()
+    
+    results = [
+        (int(pred_class), float(row[pred_class]), float(row[1]))
+        for pred_class, row in zip(pred_classes, probs_list)
+    ]
+    
+    # Clean up batch tensors
+    del batch, output, probs
+    gc.collect()
+    
+    return results
+
+def generate_gradcam_memory_safe(model, image_bytes, class_idx, profiler=None):
     """
     Memory-safe Grad-CAM generation with aggressive cleanup
     """
     device = torch.device("cpu")
+    profiler = profiler or NULL_PROFILER
     
     # Reload tensor for Grad-CAM (requires gradients)
     tensor = image_bytes_to_tensor_cpu(image_bytes, image_size=224)
@@ -139,27 +187,29 @@ def generate_gradcam_memory_safe(model, image_bytes, class_idx):
     h2 = target_layer.register_backward_hook(backward_hook)
     
     try:
-        # Forward pass
-        output = model(tensor)
-        
-        # Backward pass for gradients
-        model.zero_grad()
-        output[0, class_idx].backward()
-        
-        # Generate CAM
-        grad = gradients[0].mean(dim=(2, 3), keepdim=True)
-        cam = (grad * activations[0]).sum(dim=1).squeeze()
-        cam = F.relu(cam)
-        
-        # Normalize CAM
-        cam = cam.detach().cpu().numpy()
-        cam = cv2.resize(cam, (224, 224))
-        cam = (cam - cam.min()) / (cam.max() - cam.min() + 1e-8)
+        with profiler.stage("gradcam_autograd", track_torch=True):
+            # Forward pass
+            output = model(tensor)
+            
+            # Backward pass for gradients
+            model.zero_grad()
+            output[0, class_idx].backward()
+            
+            # Generate CAM
+            grad = gradients[0].mean(dim=(2, 3), keepdim=True)
+            cam = (grad * activations[0]).sum(dim=1).squeeze()
+            cam = F.relu(cam)
+            
+            # Normalize CAM
+            cam = cam.detach().cpu().numpy()
+            cam = cv2.resize(cam, (224, 224))
+            cam = (cam - cam.min()) / (cam.max() - cam.min() + 1e-8)
         
         # Create overlay
-        pil_img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        overlay = overlay_heatmap_on_image(pil_img, cam, alpha=0.4)
-        gradcam_b64 = pil_to_base64(overlay)
+        with profiler.stage("png_base64_encode"):
+            pil_img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            overlay = overlay_heatmap_on_image(pil_img, cam, alpha=0.4)
+            gradcam_b64 = pil_to_base64(overlay)
         
         # Cleanup
         del output, grad, cam, activations, gradients, tensor, pil_img, overlay
@@ -0,0 +1,318 @@
+# project/backend/memory_profile.py
+"""
+OPT-IN per-request memory attribution:
+- Enabled per request (X-Memory-Profile header) or globally (MEMORY_PROFILE env)
+- Records RSS, peak RSS and tracemalloc deltas per stage
+- Tensor stages also record torch CPU allocator usage via torch.profiler
+  (tensor storage bypasses tracemalloc, so its deltas stay near zero there)
+- Stages overlapping other in-flight requests are flagged `concurrent`
+- Rolling in-memory report, bounded by MEMORY_PROFILE_HISTORY
+- Zero overhead when disabled (null profiler)
+"""
+
+import os
+import time
+import uuid
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Windows - no getrusage
+    resource = None
+
+import torch
+import torch.profiler
+
+PROFILE_HEADER = "X-Memory-Profile"
+PROFILE_ID_HEADER = "X-Memory-Profile-Id"
+MEMORY_PROFILE_ENABLED = os.environ.get("MEMORY_PROFILE", "").lower() in ("1", "true", "yes")
+MEMORY_PROFILE_HISTORY = int(os.environ.get("MEMORY_PROFILE_HISTORY", 50))
+
+# Per-profile stage cap so long streams cannot grow a profile without bound
+MAX_STAGES_PER_PROFILE = 200
+
+# Rolling report - oldest profiles dropped automatically
+_profiles = deque(maxlen=MEMORY_PROFILE_HISTORY)
+
+# Number of profiled requests in flight that need tracemalloc running
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+# In-flight request tracking (all requests, profiled or not)
+_active_requests = 0
+_request_seq = 0
+
+# Lifetime peak RSS, kept here because per-stage resets clear the kernel's
+_lifetime_peak_rss_kb = None
+
+def request_started():
+    """Mark a request (HTTP or stream) as in flight"""
+    global _active_requests, _request_seq
+    _active_requests += 1
+    _request_seq += 1
+
+def request_finished():
+    """Mark a request (HTTP or stream) as done"""
+    global _active_requests
+    _active_requests = max(0, _active_requests - 1)
+
+def _read_proc_status():
+    """Current and peak RSS in KB from /proc (Linux), None elsewhere"""
+    try:
+        values = {}
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    values[key] = int(value.split()[0])
+        return values.get("VmRSS"), values.get("VmHWM")
+    except (OSError, ValueError):
+        return None, None
+
+def _rss_snapshot():
+    """
+    (rss_kb, peak_rss_kb) where the peak is since the last stage reset.
+    Falls back to getrusage for the peak, None where neither exists.
+    """
+    global _lifetime_peak_rss_kb
+
+    rss, peak = _read_proc_status()
+    if peak is None and resource is not None:
+        # ru_maxrss is in KB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if peak is not None and (_lifetime_peak_rss_kb is None or peak > _lifetime_peak_rss_kb):
+        _lifetime_peak_rss_kb = peak
+    return rss, peak
+
+def _reset_peak_rss():
+    """Reset the kernel RSS high-water mark so VmHWM is per-stage (Linux only)"""
+    # Fold the current high-water mark into the lifetime peak before clearing it
+    _rss_snapshot()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _start_torch_profile():
+    """Start a CPU memory-tracking torch profiler, None if it cannot start"""
+    try:
+        prof = torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU],
+            profile_memory=True
+        )
+        prof.__enter__()
+        return prof
+    except Exception:
+        return None
+
+def _finish_torch_profile(prof):
+    """
+    Stop the profiler and return (net_bytes, allocated_bytes) for the stage:
+    net is allocations minus frees, allocated sums ops that grew memory
+    """
+    if prof is None:
+        return None, None
+    try:
+        prof.__exit__(None, None, None)
+        net = allocated = 0
+        for event in prof.events():
+            usage = event.self_cpu_memory_usage
+            net += usage
+            if usage > 0:
+                allocated += usage
+        return net, allocated
+    except Exception:
+        return None, None
+
+def _kb(value):
+    return round(value / 1024, 1) if value is not None else None
+
+def _delta(after, before):
+    if after is None or before is None:
+        return None
+    return after - before
+
+def is_profiling_requested(header_value=None):
+    """Profiling is on if enabled globally or requested via header"""
+    if MEMORY_PROFILE_ENABLED:
+        return True
+    return (header_value or "").lower() in ("1", "true", "yes")
+
+class MemoryProfiler:
+    """
+    Collects per-stage memory measurements for a single request
+
+    Peak RSS and tracemalloc peaks are process-wide, so a stage is marked
+    `concurrent` if any other request was in flight or started while it
+    ran - its numbers then include that request's allocations.
+    """
+
+    enabled = True
+
+    def __init__(self, endpoint):
+        global _tracemalloc_users, _tracemalloc_owned
+
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.timestamp = datetime.utcnow().isoformat()
+        self.stages = []
+        self.stages_dropped = 0
+        self.concurrent = False
+        self.finished = False
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+
+        self.rss_start, _ = _rss_snapshot()
+
+    @contextmanager
+    def stage(self, name, track_torch=False):
+        """
+        Measure memory attributable to the wrapped block.
+        track_torch also records torch CPU allocator usage (adds profiler overhead).
+        """
+        seq_before = _request_seq
+        concurrent = _active_requests > 1
+        peak_reset = _reset_peak_rss()
+        tracemalloc.reset_peak()
+        rss_before, peak_before = _rss_snapshot()
+        traced_before, _ = tracemalloc.get_traced_memory()
+        torch_prof = _start_torch_profile() if track_torch else None
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            rss_after, peak_after = _rss_snapshot()
+            traced_after, traced_peak = tracemalloc.get_traced_memory()
+            torch_net, torch_allocated = _finish_torch_profile(torch_prof)
+            concurrent = concurrent or _active_requests > 1 or _request_seq != seq_before
+            self.concurrent = self.concurrent or concurrent
+
+            if len(self.stages) >= MAX_STAGES_PER_PROFILE:
+                self.stages_dropped += 1
+            else:
+                self.stages.append({
+                    "stage": name,
+                    "duration_ms": round(duration_ms, 2),
+                    "rss_before_kb": rss_before,
+                    "rss_after_kb": rss_after,
+                    "rss_delta_kb": _delta(rss_after, rss_before),
+                    "stage_peak_rss_kb": peak_after,
+                    # Growth of the high-water mark; exact per-stage peak only if reset worked
+                    "peak_rss_delta_kb": _delta(peak_after, rss_before if peak_reset else peak_before),
+                    "peak_rss_per_stage": peak_reset,
+                    "tracemalloc_delta_kb": _kb(traced_after - traced_before),
+                    "tracemalloc_peak_kb": _kb(traced_peak - traced_before),
+                    "torch_cpu_net_kb": _kb(torch_net),
+                    "torch_cpu_allocated_kb": _kb(torch_allocated),
+                    "concurrent": concurrent
+                })
+
+    def finish(self):
+        """Store the profile in the rolling report and release tracemalloc"""
+        global _tracemalloc_users, _tracemalloc_owned
+
+        if self.finished:
+            return
+        self.finished = True
+
+        rss_end, peak_end = _rss_snapshot()
+        _profiles.append({
+            "profile_id": self.profile_id,
+            "endpoint": self.endpoint,
+            "timestamp": self.timestamp,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "rss_start_kb": self.rss_start,
+            "rss_end_kb": rss_end,
+            "peak_rss_since_stage_reset_kb": peak_end,
+            "concurrent": self.concurrent,
+            "stages_dropped": self.stages_dropped,
+            "stages": self.stages
+        })
+
+        _tracemalloc_users = max(0, _tracemalloc_users - 1)
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+
+class _NullProfiler:
+    """Drop-in profiler used when profiling is off"""
+
+    enabled = False
+    profile_id = None
+
+    @contextmanager
+    def stage(self, name, track_torch=False):
+        yield
+
+    def finish(self):
+        pass
+
+NULL_PROFILER = _NullProfiler()
+
+def start_profile(endpoint, header_value=None):
+    """Return a MemoryProfiler if profiling is requested, else the null profiler"""
+    if is_profiling_requested(header_value):
+        return MemoryProfiler(endpoint)
+    return NULL_PROFILER
+
+def get_memory_report():
+    """Rolling report: recent profiles plus per-stage summary"""
+    summary = {}
+    for profile in _profiles:
+        for entry in profile["stages"]:
+            stats = summary.setdefault(entry["stage"], {
+                "count": 0,
+                "concurrent_count": 0,
+                "max_rss_delta_kb": None,
+                "max_peak_rss_delta_kb": None,
+                "max_tracemalloc_peak_kb": None,
+                "max_torch_cpu_allocated_kb": None,
+                "total_rss_delta_kb": 0,
+                "total_duration_ms": 0.0
+            })
+            stats["count"] += 1
+            stats["total_duration_ms"] += entry["duration_ms"]
+            if entry["concurrent"]:
+                stats["concurrent_count"] += 1
+            if entry["rss_delta_kb"] is not None:
+                stats["total_rss_delta_kb"] += entry["rss_delta_kb"]
+            for key, source in (
+                ("max_rss_delta_kb", "rss_delta_kb"),
+                ("max_peak_rss_delta_kb", "peak_rss_delta_kb"),
+                ("max_tracemalloc_peak_kb", "tracemalloc_peak_kb"),
+                ("max_torch_cpu_allocated_kb", "torch_cpu_allocated_kb")
+            ):
+                value = entry[source]
+                if value is not None and (stats[key] is None or value > stats[key]):
+                    stats[key] = value
+
+    for stats in summary.values():
+        stats["mean_rss_delta_kb"] = round(stats.pop("total_rss_delta_kb") / stats["count"], 1)
+        stats["mean_duration_ms"] = round(stats.pop("total_duration_ms") / stats["count"], 2)
+
+    rss, _ = _rss_snapshot()
+    return {
+        "enabled_globally": MEMORY_PROFILE_ENABLED,
+        "history_size": MEMORY_PROFILE_HISTORY,
+        "profiles_recorded": len(_profiles),
+        "current_rss_kb": rss,
+        "lifetime_peak_rss_kb": _lifetime_peak_rss_kb,
+        "stage_summary": summary,
+        "profiles": list(_profiles)
+    }
+
+def clear_memory_report():
+    """Drop all stored profiles"""
+    _profiles.clear()
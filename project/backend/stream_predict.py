@@ -0,0 +1,267 @@
+# project/backend/stream_predict.py
+"""
+MEMORY-OPTIMIZED cine-loop streaming inference:
+- Frames decoded one at a time as they arrive
+- Near-duplicate frames skipped via downsampled perceptual hash
+- Remaining frames batched through the EfficientNet model
+- Running aggregate only - no per-frame history kept
+"""
+
+import sys
+import os
+import io
+from PIL import Image
+
+# Add project root to PYTHONPATH
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.image_predict import pil_image_to_tensor_cpu, predict_tensor_batch_memory_safe
+from backend.memory_profile import NULL_PROFILER
+
+# Stream defaults (overridable per connection)
+DEFAULT_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 16
+DEFAULT_HASH_THRESHOLD = 4
+MAX_FRAME_BYTES = 5 * 1024 * 1024
+HASH_SIZE = 8
+
+# Pending frames (scored + skipped) before a forced flush, per batch slot
+PENDING_FRAMES_PER_SLOT = 4
+
+class StreamFrameError(Exception):
+    """Frames could not be scored; frame_indices lists them (already counted as failed)"""
+
+    def __init__(self, message, frame_indices):
+        super().__init__(message)
+        self.frame_indices = frame_indices
+
+class StreamBatchError(StreamFrameError):
+    """Batched scoring failed; frame_indices lists every frame that was lost"""
+
+def frame_hash(image, hash_size=HASH_SIZE):
+    """
+    Cheap difference hash (dHash) of a decoded frame
+
+    Downsamples to (hash_size + 1) x hash_size grayscale and encodes
+    whether each pixel is brighter than its right neighbour.
+    Returns a hash_size * hash_size bit integer.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    small.close()
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | int(pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two frame hashes"""
+    return bin(hash_a ^ hash_b).count('1')
+
+class CineLoopSession:
+    """
+    Per-connection state for a streamed cine loop
+
+    Holds at most `batch_size` pending tensors, duplicates of a pending
+    frame as (start, count) runs, and constant-size aggregate counters.
+    A flush is forced once `batch_size` tensors or `max_pending_frames`
+    frames are pending, so memory and latency are bounded regardless of
+    loop length or how static it is.
+    """
+
+    def __init__(self, model, batch_size=DEFAULT_BATCH_SIZE, hash_threshold=DEFAULT_HASH_THRESHOLD, profiler=None):
+        self.model = model
+        self.batch_size = max(1, min(int(batch_size), MAX_BATCH_SIZE))
+        self.hash_threshold = max(0, int(hash_threshold))
+        self.max_pending_frames = self.batch_size * PENDING_FRAMES_PER_SLOT
+        self.profiler = profiler or NULL_PROFILER
+
+        # Pending scored frames: {"frame_index", "tensor", "duplicates": [[start, count], ...]}
+        self.pending = []
+        self.pending_frames = 0
+
+        # Last frame that was queued for scoring (dedupe reference)
+        self.last_hash = None
+        self.last_result = None
+
+        # Running aggregate
+        self.frames_received = 0
+        self.frames_scored = 0
+        self.frames_skipped = 0
+        self.frames_failed = 0
+        self.malignant_frames = 0
+        self.malignant_prob_sum = 0.0
+        self.malignant_prob_max = 0.0
+        self.peak_frame_index = None
+
+    def add_frame(self, image_bytes):
+        """
+        Decode one frame and queue it for scoring unless it is a near-duplicate
+
+        Returns a list of per-frame results that are ready to be sent
+        (skipped frames resolved from the last score, or a flushed batch).
+        Raises StreamFrameError if the frame is oversized or cannot be
+        decoded, StreamBatchError if a forced flush fails.
+        """
+        frame_index = self.frames_received
+        self.frames_received += 1
+
+        try:
+            if len(image_bytes) > MAX_FRAME_BYTES:
+                raise ValueError(f"Frame exceeds {MAX_FRAME_BYTES} bytes")
+
+            with self.profiler.stage("pil_decode"):
+                image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+            try:
+                current_hash = frame_hash(image)
+                duplicate = (
+                    self.last_hash is not None
+                    and hamming_distance(current_hash, self.last_hash) <= self.hash_threshold
+                )
+                if not duplicate:
+                    with self.profiler.stage("tensor", track_torch=True):
+                        tensor = pil_image_to_tensor_cpu(image, image_size=224)
+            finally:
+                image.close()
+        except Exception as exc:
+            self.frames_failed += 1
+            raise StreamFrameError(f"Frame decode failed: {exc}", [frame_index]) from exc
+
+        if duplicate:
+            return self._skip_frame(frame_index)
+
+        self.last_hash = current_hash
+        self.pending.append({"frame_index": frame_index, "tensor": tensor, "duplicates": []})
+        self.pending_frames += 1
+
+        if len(self.pending) >= self.batch_size or self.pending_frames >= self.max_pending_frames:
+            return self.flush()
+        return []
+
+    def _skip_frame(self, frame_index):
+        """Record a duplicate frame; resolve now if its reference is already scored"""
+        self.frames_skipped += 1
+
+        # Reference already scored - resolve immediately
+        if not self.pending:
+            return [self._duplicate_result(frame_index, self.last_result)]
+
+        # Reference is the last pending frame - extend its duplicate run
+        runs = self.pending[-1]["duplicates"]
+        if runs and runs[-1][0] + runs[-1][1] == frame_index:
+            runs[-1][1] += 1
+        else:
+            runs.append([frame_index, 1])
+        self.pending_frames += 1
+
+        if self.pending_frames >= self.max_pending_frames:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        Run the pending batch through the model and return per-frame results
+
+        On failure the batch is dropped, dedupe state is reset so later
+        frames cannot reference a lost frame, and StreamBatchError reports
+        every lost frame index.
+        """
+        if not self.pending:
+            return []
+
+        tensors = [entry["tensor"] for entry in self.pending]
+        try:
+            with self.profiler.stage("forward", track_torch=True):
+                scores = predict_tensor_batch_memory_safe(self.model, tensors)
+        except Exception as exc:
+            lost = self._pending_indices()
+            self.frames_failed += len(lost)
+            self.frames_skipped -= len(lost) - len(self.pending)
+            self._reset_pending()
+            self.last_hash = None
+            raise StreamBatchError(f"Batch scoring failed: {exc}", lost) from exc
+        finally:
+            del tensors
+
+        results = []
+        for entry, (pred_class, prob, malignant_prob) in zip(self.pending, scores):
+            result = {
+                "frame_index": entry["frame_index"],
+                "prediction": "benign" if pred_class == 0 else "malignant",
+                "confidence": round(prob * 100, 2),
+                "predicted_class": pred_class,
+                "probability": prob,
+                "malignant_probability": malignant_prob,
+                "skipped": False,
+                "duplicate_of": None
+            }
+            self._update_aggregate(result)
+            self.last_result = result
+            results.append(result)
+
+            for start, count in entry["duplicates"]:
+                for frame_index in range(start, start + count):
+                    results.append(self._duplicate_result(frame_index, result))
+
+        self._reset_pending()
+        return results
+
+    def _pending_indices(self):
+        """All frame indices (scored and skipped) waiting in the pending batch"""
+        indices = []
+        for entry in self.pending:
+            indices.append(entry["frame_index"])
+            for start, count in entry["duplicates"]:
+                indices.extend(range(start, start + count))
+        return indices
+
+    def _reset_pending(self):
+        self.pending = []
+        self.pending_frames = 0
+
+    def _duplicate_result(self, frame_index, reference):
+        """Per-frame result for a skipped frame, reusing the reference score"""
+        result = dict(reference)
+        result["frame_index"] = frame_index
+        result["skipped"] = True
+        result["duplicate_of"] = reference["frame_index"]
+        return result
+
+    def _update_aggregate(self, result):
+        """Fold one scored frame into the running aggregate"""
+        malignant_prob = result["malignant_probability"]
+        self.frames_scored += 1
+        self.malignant_prob_sum += malignant_prob
+        if result["predicted_class"] == 1:
+            self.malignant_frames += 1
+        if self.peak_frame_index is None or malignant_prob > self.malignant_prob_max:
+            self.malignant_prob_max = malignant_prob
+            self.peak_frame_index = result["frame_index"]
+
+    def aggregate(self):
+        """Running aggregate over all scored frames so far"""
+        if self.frames_scored == 0:
+            mean_prob = 0.0
+            prediction = None
+        else:
+            mean_prob = self.malignant_prob_sum / self.frames_scored
+            prediction = "malignant" if mean_prob > 0.5 else "benign"
+
+        return {
+            "prediction": prediction,
+            "confidence": round(max(mean_prob, 1 - mean_prob) * 100, 2) if prediction else None,
+            "mean_malignant_probability": round(mean_prob, 4),
+            "max_malignant_probability": round(self.malignant_prob_max, 4),
+            "peak_frame_index": self.peak_frame_index,
+            "frames_received": self.frames_received,
+            "frames_scored": self.frames_scored,
+            "frames_skipped": self.frames_skipped,
+            "frames_failed": self.frames_failed,
+            "malignant_frames": self.malignant_frames,
+            "pending_frames": self.pending_frames
+        }